@@ -2,8 +2,9 @@
 RunPod Serverless Handler for Chatterbox TTS
 
 Voice reference is baked into the Docker image at build time.
-The model loads with pre-prepared voice conditionals so every
-request is just: text in → audio out.
+The voice conditionals are prepared from it once at build time
+(prepare_voice.py) and loaded on cold start, so every request is
+just: text in → audio out.
 
 Accepts:
   - text (str): Text to synthesize
@@ -11,18 +12,77 @@ Accepts:
   - temperature (float, optional): Generation temperature (default 0.7)
   - cfg (float, optional): CFG weight (default 0.5)
   - output_format (str, optional): "mp3" or "wav" (default "wav")
+
+Concurrent jobs are funneled through a single GPU worker thread that
+groups jobs with matching generation parameters into one batched
+generate call (up to MAX_BATCH jobs collected within BATCH_WINDOW_MS).
+Repeated inputs are answered from an LRU cache of finished payloads.
 """
 
-import io
-import base64
+import os
+import time
+import atexit
+import shutil
+import struct
+import queue
+import tempfile
+import hashlib
+import logging
+import logging.handlers
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import lameenc
+import pybase64
 import runpod
 import torch
-import torchaudio as ta
-from pydub import AudioSegment
+
+torch.set_grad_enabled(False)
+
+# Logging goes through a queue so handler threads never block on the stdout pipe
+log = logging.getLogger("chatterbox")
+log.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+log.propagate = False
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("[Chatterbox] %(message)s"))
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+LOG_LISTENER = logging.handlers.QueueListener(_log_queue, _log_stream)
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)  # drain queued records before the interpreter exits
 
 # Global model instance (loaded once on cold start, with voice pre-baked)
 MODEL = None
 VOICE_REF_PATH = "/app/voice/reference.mp3"
+VOICE_CONDS_PATH = "/app/voice/conds.pt"  # written at build time by prepare_voice.py
+
+# Request pool settings
+MAX_BATCH = int(os.environ.get("MAX_BATCH", 8))
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 10))
+
+# Run T3 in bf16 (fp16 on GPUs without bf16); S3Gen stays fp32 for its STFT/iSTFT
+T3_HALF_PRECISION = os.environ.get("T3_HALF_PRECISION", "1") == "1"
+
+# torch.compile settings (CUDA only; first compile adds to cold start)
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "0") == "1"
+# No CUDA graphs by default: the KV cache grows every decode step, so graphs would be
+# re-recorded per length rather than replayed
+TORCH_COMPILE_MODE = os.environ.get("TORCH_COMPILE_MODE", "default")
+
+# High-priority stream for generation so it is not held up by other GPU work
+GEN_STREAM = torch.cuda.Stream(priority=-1) if torch.cuda.is_available() else None
+
+# Result cache: final payloads for repeated inputs, in RAM with overflow to tmpfs
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 256))
+RESULT_CACHE_MEMORY_BYTES = int(os.environ.get("RESULT_CACHE_MEMORY_BYTES", 128 << 20))
+RESULT_CACHE_ROOT = os.environ.get("RESULT_CACHE_ROOT", "/dev/shm")
+# /dev/shm is RAM and Docker's default is only 64 MB, so keep the spill budget well under that
+RESULT_CACHE_DISK_BYTES = int(os.environ.get("RESULT_CACHE_DISK_BYTES", 32 << 20))
+
+# Encoding + base64 runs here so the event loop and GPU worker never wait on it
+POSTPROC_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chatterbox-postproc")
 
 
 def load_model():
@@ -31,22 +91,287 @@ def load_model():
     if MODEL is not None:
         return MODEL
 
-    from chatterbox.tts import ChatterboxTTS
+    from chatterbox.tts import ChatterboxTTS, Conditionals
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"[Chatterbox] Loading model on device: {device}")
-    MODEL = ChatterboxTTS.from_pretrained(device=device)
-    print("[Chatterbox] Model loaded successfully")
+    log.info("Loading model on device: %s", device)
+    model = ChatterboxTTS.from_pretrained(device=device)
+    log.info("Model loaded successfully")
+
+    if T3_HALF_PRECISION and device == "cuda":
+        # Native bf16 only (Ampere+); T4/V100 would otherwise get slow emulated bf16
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported(including_emulation=False) else torch.float16
+        log.info("Casting T3 to %s", dtype)
+        model.t3.to(dtype)
+
+    if os.path.exists(VOICE_CONDS_PATH):
+        # Load voice conditionals serialized at build time (skips the encoder pass)
+        log.info("Loading voice conditionals from: %s", VOICE_CONDS_PATH)
+        model.conds = Conditionals.load(VOICE_CONDS_PATH, map_location=device).to(device)
+    else:
+        # Prepare voice conditionals from baked-in reference audio
+        log.info("Preparing voice conditionals from: %s", VOICE_REF_PATH)
+        model.prepare_conditionals(VOICE_REF_PATH, exaggeration=0.3)
+    log.info("Voice conditionals ready - all requests will use this voice")
 
-    # Prepare voice conditionals from baked-in reference audio
-    print(f"[Chatterbox] Preparing voice conditionals from: {VOICE_REF_PATH}")
-    MODEL.prepare_conditionals(VOICE_REF_PATH, exaggeration=0.3)
-    print("[Chatterbox] Voice conditionals ready - all requests will use this voice")
+    if TORCH_COMPILE and device == "cuda":
+        # Compile the per-step hot paths: the T3 Llama decode and the S3Gen CFM estimator.
+        # `.forward` is patched (not the module) since both are called through it directly.
+        log.info("Compiling T3 backbone and S3Gen estimator (mode=%s)", TORCH_COMPILE_MODE)
+        tfmr = model.t3.tfmr
+        tfmr.forward = torch.compile(tfmr.forward, mode=TORCH_COMPILE_MODE, dynamic=True)
+        estimator = model.s3gen.flow.decoder.estimator
+        estimator.forward = torch.compile(estimator.forward, mode=TORCH_COMPILE_MODE, dynamic=True)
 
+    # Warm up both T3 and S3Gen at a realistic length so cuDNN/cuBLAS init, allocator
+    # growth (and compilation, if enabled) happen at cold start
+    log.info("Running warmup generation")
+    if GEN_STREAM is not None:
+        # GEN_STREAM does not sync with the default stream, where the dtype cast and conds copy ran
+        GEN_STREAM.wait_stream(torch.cuda.current_stream())
+    with torch.inference_mode(), torch.cuda.stream(GEN_STREAM):
+        model.generate_batch(
+            ["This is a warmup utterance to initialise the GPU kernels."],
+            exaggeration=0.3,
+            temperature=0.7,
+            cfg_weight=0.5,
+        )
+    if device == "cuda":
+        torch.cuda.synchronize()
+    log.info("Warmup done")
+
+    # Publish only once fully initialised, so no caller sees a half-loaded model
+    MODEL = model
     return MODEL
 
 
-def handler(job):
+def to_int16_pcm(wav):
+    """Convert a float wav tensor in [-1, 1] to raw 16-bit PCM bytes."""
+    return (wav.clamp(-1, 1) * 32767).to(torch.int16).cpu().numpy().tobytes()
+
+
+def encode_wav(pcm, sr):
+    """Wrap 16-bit mono PCM as WAV bytes (RIFF header written by hand)."""
+    header = (
+        b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sr, sr * 2, 2, 16)
+        + b"data" + struct.pack("<I", len(pcm))
+    )
+    return header + pcm
+
+
+def encode_mp3(pcm, sr, bitrate=192):
+    """Encode 16-bit mono PCM to MP3 in memory with LAME (no ffmpeg subprocess)."""
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(bitrate)
+    encoder.set_in_sample_rate(sr)
+    encoder.set_channels(1)
+    return encoder.encode(pcm) + encoder.flush()
+
+
+def encode_audio(wav, sr, output_format):
+    """Encode a generated wav to the requested format and return it base64-encoded."""
+    pcm = to_int16_pcm(wav)
+    body = encode_mp3(pcm, sr) if output_format == "mp3" else encode_wav(pcm, sr)
+    return pybase64.b64encode_as_string(body)
+
+
+class RequestPool:
+    """
+    Collects concurrent TTS jobs and runs them on the GPU from a single worker thread.
+
+    The worker blocks for the first pending job, then drains up to `max_batch` jobs
+    until `window_ms` has passed. Jobs sharing the same generation parameters are
+    synthesized with one `generate_batch` call, and each wav is handed to its future
+    as soon as it is vocoded.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH, window_ms=BATCH_WINDOW_MS):
+        self.max_batch = max_batch
+        self.window_s = window_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="chatterbox-gpu", daemon=True)
+        self._worker.start()
+
+    def submit(self, text, params):
+        """Enqueue a job and return a future resolving to its wav tensor."""
+        future = Future()
+        self._queue.put((text, params, future))
+        return future
+
+    def _drain(self):
+        jobs = [self._queue.get()]
+        deadline = time.monotonic() + self.window_s
+        while len(jobs) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                jobs.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run(self):
+        while True:
+            groups = {}
+            for text, params, future in self._drain():
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault(tuple(sorted(params.items())), []).append((text, future))
+
+            for params, jobs in groups.items():
+                # Resolve each future as soon as its wav is vocoded, so post-processing of
+                # early rows overlaps with the vocoder passes of later ones
+                def on_wav(i, wav, jobs=jobs):
+                    jobs[i][1].set_result(wav)
+
+                try:
+                    model = load_model()
+                    # Grad mode is thread-local, so inference_mode is entered on this worker thread
+                    with torch.inference_mode(), torch.cuda.stream(GEN_STREAM):
+                        model.generate_batch([text for text, _ in jobs], on_wav=on_wav, **dict(params))
+                except Exception as e:
+                    for _, future in jobs:
+                        if not future.done():
+                            future.set_exception(e)
+
+
+REQUEST_POOL = RequestPool()
+
+
+class ResultCache:
+    """
+    LRU cache of final base64 payloads keyed by text and generation settings.
+
+    The in-memory tier holds at most `capacity` payloads and `memory_bytes` in total.
+    Entries evicted from it spill to files in a fresh directory under `disk_root`
+    (tmpfs on RunPod), which is trimmed oldest-first to `disk_bytes`.
+    The voice is fixed per image, so it is not part of the key.
+
+    `peek` only touches memory and is safe on the event loop; `get` and `put` may do
+    file I/O and are meant to run on POSTPROC_POOL. The lock only guards the indexes,
+    never file I/O.
+    """
+
+    def __init__(
+        self,
+        capacity=RESULT_CACHE_SIZE,
+        memory_bytes=RESULT_CACHE_MEMORY_BYTES,
+        disk_root=RESULT_CACHE_ROOT,
+        disk_bytes=RESULT_CACHE_DISK_BYTES,
+    ):
+        self.capacity = capacity
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._memory_used = 0
+        self._disk_entries = OrderedDict()  # key -> payload size on disk
+        self._disk_used = 0
+
+        self.disk_dir = None
+        if capacity > 0 and disk_bytes > 0 and os.path.isdir(disk_root):
+            self.disk_dir = tempfile.mkdtemp(prefix="tts-cache-", dir=disk_root)
+            atexit.register(shutil.rmtree, self.disk_dir, ignore_errors=True)
+
+    @staticmethod
+    def key(text, exaggeration, temperature, cfg_weight, output_format):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(text.encode("utf-8"))
+        h.update(struct.pack("<ddd", exaggeration, temperature, cfg_weight))
+        h.update(output_format.encode("utf-8"))
+        return h.hexdigest()
+
+    def peek(self, key):
+        """Return the payload for `key` if it is held in memory, else None. No file I/O."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def has_spilled(self, key):
+        """Whether `key` currently lives in the disk tier."""
+        with self._lock:
+            return key in self._disk_entries
+
+    def get(self, key):
+        """Return the cached payload for `key` from either tier, or None. May read a file."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            if key not in self._disk_entries:
+                return None
+            self._disk_used -= self._disk_entries.pop(key)
+
+        path = os.path.join(self.disk_dir, key)
+        try:
+            with open(path, "r") as f:
+                value = f.read()
+        except OSError:
+            value = None
+        self._unlink(path)
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Insert `value` into the memory tier, spilling what no longer fits. May write files."""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._memory_used -= len(self._entries[key])
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._memory_used += len(value)
+            evicted = []
+            while self._entries and (len(self._entries) > self.capacity or self._memory_used > self.memory_bytes):
+                old_key, old_value = self._entries.popitem(last=False)
+                self._memory_used -= len(old_value)
+                evicted.append((old_key, old_value))
+
+        for old_key, old_value in evicted:
+            self._spill(old_key, old_value)
+
+    def _spill(self, key, value):
+        if self.disk_dir is None or len(value) > self.disk_bytes:
+            return
+        path = os.path.join(self.disk_dir, key)
+        try:
+            with open(path, "w") as f:
+                f.write(value)
+        except OSError as e:
+            # e.g. ENOSPC on a small /dev/shm: don't leave a partial, untracked file behind
+            log.warning("Could not spill result cache entry to disk: %s", e)
+            self._unlink(path)
+            return
+
+        with self._lock:
+            self._disk_entries[key] = len(value)
+            self._disk_used += len(value)
+            trimmed = []
+            while self._disk_used > self.disk_bytes:
+                old_key, size = self._disk_entries.popitem(last=False)
+                self._disk_used -= size
+                trimmed.append(old_key)
+
+        for old_key in trimmed:
+            self._unlink(os.path.join(self.disk_dir, old_key))
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+RESULT_CACHE = ResultCache()
+
+
+async def handler(job):
     """RunPod serverless handler."""
     job_input = job["input"]
 
@@ -57,41 +382,44 @@ def handler(job):
     exaggeration = float(job_input.get("exaggeration", 0.3))
     temperature = float(job_input.get("temperature", 0.7))
     cfg_weight = float(job_input.get("cfg", 0.5))
-    output_format = job_input.get("output_format", "wav").lower()
+    output_format = str(job_input.get("output_format", "wav")).strip().lower()
 
-    print(f"[Chatterbox] Generating TTS:")
-    print(f"  text: {text[:100]}...")
-    print(f"  exaggeration: {exaggeration}")
-    print(f"  temperature: {temperature}")
-    print(f"  cfg: {cfg_weight}")
-    print(f"  output_format: {output_format}")
+    log.info(
+        "Generating TTS: text=%.100r exaggeration=%s temperature=%s cfg=%s output_format=%s",
+        text, exaggeration, temperature, cfg_weight, output_format,
+    )
 
     model = load_model()
 
+    # Serve repeated inputs straight from the result cache, skipping the model entirely
+    cache_key = ResultCache.key(text, exaggeration, temperature, cfg_weight, output_format)
+    audio_base64 = RESULT_CACHE.peek(cache_key)
+    if audio_base64 is None and RESULT_CACHE.has_spilled(cache_key):
+        audio_base64 = await asyncio.wrap_future(POSTPROC_POOL.submit(RESULT_CACHE.get, cache_key))
+    if audio_base64 is not None:
+        log.debug("Result cache hit (%s)", cache_key)
+        return {
+            "audio_base64": audio_base64,
+            "format": output_format,
+            "sample_rate": model.sr,
+        }
+
     try:
-        # Generate using pre-baked voice conditionals
-        wav = model.generate(
+        # Generate using pre-baked voice conditionals, batched with any concurrent jobs
+        future = REQUEST_POOL.submit(
             text,
-            exaggeration=exaggeration,
-            temperature=temperature,
-            cfg_weight=cfg_weight,
+            dict(exaggeration=exaggeration, temperature=temperature, cfg_weight=cfg_weight),
         )
+        wav = await asyncio.wrap_future(future)
 
-        # Convert to output format
-        wav_buffer = io.BytesIO()
-        ta.save(wav_buffer, wav, model.sr, format="wav")
-        wav_buffer.seek(0)
-
-        if output_format == "mp3":
-            audio_segment = AudioSegment.from_wav(wav_buffer)
-            mp3_buffer = io.BytesIO()
-            audio_segment.export(mp3_buffer, format="mp3", bitrate="192k")
-            mp3_buffer.seek(0)
-            audio_base64 = base64.b64encode(mp3_buffer.read()).decode("utf-8")
-        else:
-            audio_base64 = base64.b64encode(wav_buffer.read()).decode("utf-8")
+        # Convert to output format off the event loop; the GPU worker has already moved on
+        audio_base64 = await asyncio.wrap_future(
+            POSTPROC_POOL.submit(encode_audio, wav, model.sr, output_format)
+        )
 
-        print(f"[Chatterbox] Audio generated successfully ({len(audio_base64)} bytes base64)")
+        log.debug("Audio generated successfully (%d bytes base64)", len(audio_base64))
+        # Fire-and-forget: a put may spill to /dev/shm, which the response need not wait for
+        POSTPROC_POOL.submit(RESULT_CACHE.put, cache_key, audio_base64)
 
         return {
             "audio_base64": audio_base64,
@@ -100,10 +428,15 @@ def handler(job):
         }
 
     except Exception as e:
-        print(f"[Chatterbox] Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error: %s", e)
         return {"error": str(e)}
 
 
-runpod.serverless.start({"handler": handler})
+# Load, compile and warm up during cold start, before RunPod hands us any jobs
+load_model()
+
+runpod.serverless.start({
+    "handler": handler,
+    # Let RunPod hand us up to MAX_BATCH jobs at once so the pool can batch them
+    "concurrency_modifier": lambda current_concurrency: MAX_BATCH,
+})
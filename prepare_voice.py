@@ -0,0 +1,28 @@
+"""
+Build-time voice preparation for the RunPod handler.
+
+Runs prepare_conditionals once on the reference audio baked into the image
+and saves the resulting conditionals next to it. handler.py loads this file
+on cold start instead of re-running the voice encoder and tokenizers.
+"""
+
+import torch
+from chatterbox.tts import ChatterboxTTS
+
+VOICE_REF_PATH = "/app/voice/reference.mp3"
+VOICE_CONDS_PATH = "/app/voice/conds.pt"
+
+
+def main():
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"[Chatterbox] Loading model on device: {device}")
+    model = ChatterboxTTS.from_pretrained(device=device)
+
+    print(f"[Chatterbox] Preparing voice conditionals from: {VOICE_REF_PATH}")
+    model.prepare_conditionals(VOICE_REF_PATH, exaggeration=0.3)
+    model.conds.to("cpu").save(VOICE_CONDS_PATH)
+    print(f"[Chatterbox] Voice conditionals saved to: {VOICE_CONDS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,6 @@ from .modules.learned_pos_emb import LearnedPositionEmbeddings
 from .modules.cond_enc import T3CondEnc, T3Cond
 from .modules.t3_config import T3Config
 from .llama_configs import LLAMA_CONFIGS
-from .inference.t3_hf_backend import T3HuggingfaceBackend
 from ..utils import AttrDict
 
 
@@ -68,10 +67,15 @@ class T3(nn.Module):
     def device(self):
         return self.speech_head.weight.device
 
+    @property
+    def dtype(self):
+        return self.speech_head.weight.dtype
+
     def prepare_conditioning(self, t3_cond: T3Cond):
         """
         Token cond data needs to be embedded, so that needs to be here instead of in `T3CondEnc`.
         """
+        t3_cond.to(dtype=self.dtype)  # every float field, e.g. fp32 conds with a bf16 model
         if t3_cond.cond_prompt_speech_tokens is not None and t3_cond.cond_prompt_speech_emb is None:
             t3_cond.cond_prompt_speech_emb = self.speech_emb(t3_cond.cond_prompt_speech_tokens) + \
                 self.speech_pos_emb(t3_cond.cond_prompt_speech_tokens)
@@ -225,147 +229,151 @@ class T3(nn.Module):
     ):
         """
         Args:
-            text_tokens: a 1D (unbatched) or 2D (batched) tensor.
+            text_tokens: a 1D tensor, or a 2D tensor whose first row is the text (any second row
+                is the CFG copy, which is rebuilt internally).
         """
         # Validate / sanitize inputs
         assert prepend_prompt_speech_tokens is None, "not implemented"
+        assert initial_speech_tokens is None, "not implemented"
         _ensure_BOT_EOT(text_tokens, self.hp)
         text_tokens = torch.atleast_2d(text_tokens).to(dtype=torch.long, device=self.device)
 
-        # Default initial speech to a single start-of-speech token
-        if initial_speech_tokens is None:
-            initial_speech_tokens = self.hp.start_speech_token * torch.ones_like(text_tokens[:, :1])
-
-        # Prepare custom input embeds
-        embeds, len_cond = self.prepare_input_embeds(
+        # Decode through the batched path; it builds the CFG uncond row from the first row itself
+        speech_tokens = self.inference_batch(
             t3_cond=t3_cond,
-            text_tokens=text_tokens,
-            speech_tokens=initial_speech_tokens,
+            text_tokens=[text_tokens[0]],
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            min_p=min_p,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
             cfg_weight=cfg_weight,
-        )
+        )[0]
+        return speech_tokens[None]  # (1, num_tokens)
 
-        # In order to use the standard HF generate method, we need to extend some methods to inject our custom logic
-        # Note the llama-specific logic. Other tfmr types can be added later.
+    @torch.inference_mode()
+    def inference_batch(
+        self,
+        *,
+        t3_cond: T3Cond,
+        text_tokens: List[Tensor],
+        max_new_tokens=None,
+        temperature=0.8,
+        min_p=0.05,
+        top_p=1.00,
+        repetition_penalty=1.2,
+        cfg_weight=0,
+    ):
+        """
+        Batched variant of `inference` for several texts sharing one set of conditionals.
+        Sequences are left-padded and masked so each row decodes exactly as it would alone.
 
-        self.compiled = False
+        Args:
+            text_tokens: a list of 1D tensors, each wrapped in start / stop text tokens.
+        Returns:
+            a list of 1D tensors of predicted speech tokens, one per text.
+        """
+        B = len(text_tokens)
+        text_tokens = [t.to(dtype=torch.long, device=self.device).view(1, -1) for t in text_tokens]
+        for t in text_tokens:
+            _ensure_BOT_EOT(t, self.hp)
 
-        # TODO? synchronize the expensive compile function
-        # with self.compile_lock:
-        if not self.compiled:
-            patched_model = T3HuggingfaceBackend(
-                config=self.cfg,
-                llama=self.tfmr,
-                speech_enc=self.speech_emb,
-                speech_head=self.speech_head,
-                alignment_stream_analyzer=None,
-            )
-            self.patched_model = patched_model
-            self.compiled = True
-
-        # # Run normal generate method, which calls our custom extended methods
-        # return self.patched_model.generate(
-        #     inputs=initial_speech_tokens,
-        #     decoder_cond=embeds,
-        #     bos_token_id=self.hp.start_speech_token,
-        #     eos_token_id=(self.hp.stop_speech_token if stop_on_eos else -1),
-        #     pad_token_id=self.hp.stop_speech_token,
-        #     max_new_tokens=max_new_tokens or self.hp.max_speech_tokens,
-        #     num_return_sequences=num_return_sequences,
-        #     temperature=temperature,
-        #     min_p=min_p,
-        #     length_penalty=length_penalty,
-        #     repetition_penalty=repetition_penalty,
-        #     do_sample=do_sample,
-        #     # cache_implementation=None if not self.compiled else "static",
-        # )
-
-        device = embeds.device
+        cond_emb = self.prepare_conditioning(t3_cond)[0]  # (len_cond, dim)
+        device, dtype = cond_emb.device, cond_emb.dtype
 
         bos_token = torch.tensor([[self.hp.start_speech_token]], dtype=torch.long, device=device)
-        bos_embed = self.speech_emb(bos_token)  # shape: (B, 1, embed_dim)
-        bos_embed = bos_embed + self.speech_pos_emb.get_fixed_embedding(0)
-
-        # batch_size=2 for CFG
-        bos_embed = torch.cat([bos_embed, bos_embed])
-
-        # Combine condition and BOS token for the initial input if cfg_weight > 0
-        if cfg_weight > 0:
-            inputs_embeds = torch.cat([embeds, bos_embed], dim=1)
-        else:
-            inputs_embeds = embeds
+        bos_embed = self.speech_emb(bos_token) + self.speech_pos_emb(bos_token)  # (1, 1, dim)
+        bos_embed = bos_embed[0]
+        if cfg_weight > 0.0:
+            # match `inference`, which appends a second BOS embedding when CFG is on
+            bos_embed = torch.cat([bos_embed, bos_embed])
 
-        # Track generated token ids; start with the BOS token.
-        generated_ids = bos_token.clone()
-        predicted = []  # To store the predicted tokens
+        # Build per-row prefixes: cond rows first, then the CFG uncond rows (zeroed text embeddings)
+        rows = []
+        for t in text_tokens:
+            rows.append(torch.cat([cond_emb, (self.text_emb(t) + self.text_pos_emb(t))[0], bos_embed]))
+        if cfg_weight > 0.0:
+            for t in text_tokens:
+                rows.append(torch.cat([cond_emb, self.text_pos_emb(t), bos_embed]))
+
+        # Left-pad to a common length
+        max_len = max(r.size(0) for r in rows)
+        inputs_embeds = torch.zeros(len(rows), max_len, self.dim, dtype=dtype, device=device)
+        attention_mask = torch.zeros(len(rows), max_len, dtype=torch.long, device=device)
+        for i, r in enumerate(rows):
+            inputs_embeds[i, max_len - r.size(0):] = r
+            attention_mask[i, max_len - r.size(0):] = 1
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        generated_ids = bos_token.expand(B, 1).clone()
+        finished = torch.zeros(B, dtype=torch.bool, device=device)
+        predicted = []
 
-        # Instantiate the logits processors.
         min_p_warper = MinPLogitsWarper(min_p=min_p)
         top_p_warper = TopPLogitsWarper(top_p=top_p)
         repetition_penalty_processor = RepetitionPenaltyLogitsProcessor(penalty=float(repetition_penalty))
 
         # ---- Initial Forward Pass (no kv_cache yet) ----
-        output = self.patched_model(
+        output = self.tfmr(
             inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
             past_key_values=None,
             use_cache=True,
-            output_attentions=True,
-            output_hidden_states=True,
             return_dict=True,
         )
-        # Initialize kv_cache with the full context.
         past = output.past_key_values
 
         # ---- Generation Loop using kv_cache ----
-        for i in tqdm(range(max_new_tokens), desc="Sampling", dynamic_ncols=True):
-            logits = output.logits[:, -1, :]
+        for i in tqdm(range(max_new_tokens or self.hp.max_speech_tokens), desc="Sampling", dynamic_ncols=True):
+            logits = self.speech_head(output.last_hidden_state[:, -1, :]).float()
 
             # CFG
             if cfg_weight > 0.0:
-                logits_cond = logits[0:1]
-                logits_uncond = logits[1:2]
+                logits_cond = logits[:B]
+                logits_uncond = logits[B:]
                 logits = logits_cond + cfg_weight * (logits_cond - logits_uncond)
 
-            logits = logits.squeeze(1)
-
-            # Apply temperature scaling.
             if temperature != 1.0:
                 logits = logits / temperature
 
-            # Apply repetition penalty and top‑p filtering.
             logits = repetition_penalty_processor(generated_ids, logits)
             logits = min_p_warper(None, logits)
             logits = top_p_warper(None, logits)
 
-            # Convert logits to probabilities and sample the next token.
             probs = torch.softmax(logits, dim=-1)
             next_token = torch.multinomial(probs, num_samples=1)  # shape: (B, 1)
 
+            # Rows that already emitted EOS keep emitting it
+            next_token = next_token.masked_fill(finished[:, None], self.hp.stop_speech_token)
             predicted.append(next_token)
             generated_ids = torch.cat([generated_ids, next_token], dim=1)
 
-            # Check for EOS token.
-            if next_token.view(-1) == self.hp.stop_speech_token:
+            finished |= next_token.view(-1) == self.hp.stop_speech_token
+            if finished.all():
                 break
 
-            # Get embedding for the new token.
             next_token_embed = self.speech_emb(next_token)
             next_token_embed = next_token_embed + self.speech_pos_emb.get_fixed_embedding(i + 1)
-
-            #  For CFG
             if cfg_weight > 0.0:
                 next_token_embed = torch.cat([next_token_embed, next_token_embed])
 
-            # Forward pass with only the new token and the cached past.
-            output = self.patched_model(
+            attention_mask = F.pad(attention_mask, (0, 1), value=1)
+            position_ids = position_ids[:, -1:] + 1
+            output = self.tfmr(
                 inputs_embeds=next_token_embed,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
                 past_key_values=past,
-                output_attentions=True,
-                output_hidden_states=True,
+                use_cache=True,
                 return_dict=True,
             )
-            # Update the kv_cache.
             past = output.past_key_values
 
-        # Concatenate all predicted tokens along the sequence dimension.
+        # Trim each row after its first EOS (kept, as in `inference`)
         predicted_tokens = torch.cat(predicted, dim=1)  # shape: (B, num_tokens)
-        return predicted_tokens
+        results = []
+        for row in predicted_tokens:
+            eos = (row == self.hp.stop_speech_token).nonzero()
+            results.append(row[:eos[0, 0] + 1] if len(eos) else row)
+        return results
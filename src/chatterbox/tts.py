@@ -205,6 +205,15 @@ class ChatterboxTTS:
         ).to(device=self.device)
         self.conds = Conditionals(t3_cond, s3gen_ref_dict)
 
+    def _update_exaggeration(self, exaggeration):
+        if exaggeration != self.conds.t3.emotion_adv[0, 0, 0]:
+            _cond: T3Cond = self.conds.t3
+            self.conds.t3 = T3Cond(
+                speaker_emb=_cond.speaker_emb,
+                cond_prompt_speech_tokens=_cond.cond_prompt_speech_tokens,
+                emotion_adv=exaggeration * torch.ones(1, 1, 1),
+            ).to(device=self.device, dtype=_cond.speaker_emb.dtype)
+
     def generate(
         self,
         text,
@@ -221,29 +230,39 @@ class ChatterboxTTS:
         else:
             assert self.conds is not None, "Please `prepare_conditionals` first or specify `audio_prompt_path`"
 
-        # Update exaggeration if needed
-        if exaggeration != self.conds.t3.emotion_adv[0, 0, 0]:
-            _cond: T3Cond = self.conds.t3
-            self.conds.t3 = T3Cond(
-                speaker_emb=_cond.speaker_emb,
-                cond_prompt_speech_tokens=_cond.cond_prompt_speech_tokens,
-                emotion_adv=exaggeration * torch.ones(1, 1, 1),
-            ).to(device=self.device)
-
-        # Norm and tokenize text
-        text = punc_norm(text)
-        text_tokens = self.tokenizer.text_to_tokens(text).to(self.device)
-
-        if cfg_weight > 0.0:
-            text_tokens = torch.cat([text_tokens, text_tokens], dim=0)  # Need two seqs for CFG
+        return self.generate_batch(
+            [text],
+            repetition_penalty=repetition_penalty,
+            min_p=min_p,
+            top_p=top_p,
+            exaggeration=exaggeration,
+            cfg_weight=cfg_weight,
+            temperature=temperature,
+        )[0]
+
+    def generate_batch(
+        self,
+        texts,
+        repetition_penalty=1.2,
+        min_p=0.05,
+        top_p=1.0,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        on_wav=None,
+    ):
+        """
+        Generate several texts with the current conditionals in one batched T3 decode.
+        The S3Gen vocoder still runs once per text; if given, `on_wav(i, wav)` is called
+        as soon as text `i` is vocoded. Returns a list of wavs, one per text.
+        """
+        assert self.conds is not None, "Please `prepare_conditionals` first"
+        self._update_exaggeration(exaggeration)
 
-        sot = self.t3.hp.start_text_token
-        eot = self.t3.hp.stop_text_token
-        text_tokens = F.pad(text_tokens, (1, 0), value=sot)
-        text_tokens = F.pad(text_tokens, (0, 1), value=eot)
+        text_tokens = [self._tokenize(text) for text in texts]
 
         with torch.inference_mode():
-            speech_tokens = self.t3.inference(
+            batch_speech_tokens = self.t3.inference_batch(
                 t3_cond=self.conds.t3,
                 text_tokens=text_tokens,
                 max_new_tokens=1000,  # TODO: use the value in config
@@ -253,20 +272,30 @@ class ChatterboxTTS:
                 min_p=min_p,
                 top_p=top_p,
             )
-            # Extract only the conditional batch.
-            speech_tokens = speech_tokens[0]
-
-            # TODO: output becomes 1D
-            speech_tokens = drop_invalid_tokens(speech_tokens)
-            
-            speech_tokens = speech_tokens[speech_tokens < 6561]
-
-            speech_tokens = speech_tokens.to(self.device)
-
-            wav, _ = self.s3gen.inference(
-                speech_tokens=speech_tokens,
-                ref_dict=self.conds.gen,
-            )
-            wav = wav.squeeze(0).detach().cpu().numpy()
-            watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=self.sr)
-        return torch.from_numpy(watermarked_wav).unsqueeze(0)
\ No newline at end of file
+            wavs = []
+            for i, speech_tokens in enumerate(batch_speech_tokens):
+                wavs.append(self._vocode(speech_tokens))
+                if on_wav is not None:
+                    on_wav(i, wavs[-1])
+            return wavs
+
+    def _tokenize(self, text):
+        """Normalize and tokenize `text`, wrapped in start / stop text tokens (1D)."""
+        text_tokens = self.tokenizer.text_to_tokens(punc_norm(text)).to(self.device)
+        text_tokens = F.pad(text_tokens, (1, 0), value=self.t3.hp.start_text_token)
+        text_tokens = F.pad(text_tokens, (0, 1), value=self.t3.hp.stop_text_token)
+        return text_tokens[0]
+
+    def _vocode(self, speech_tokens):
+        """Turn T3 speech tokens into a watermarked wav of shape (1, L) on CPU."""
+        speech_tokens = drop_invalid_tokens(speech_tokens)
+        speech_tokens = speech_tokens[speech_tokens < 6561]
+        speech_tokens = speech_tokens.to(self.device)
+
+        wav, _ = self.s3gen.inference(
+            speech_tokens=speech_tokens,
+            ref_dict=self.conds.gen,
+        )
+        wav = wav.squeeze(0).detach().cpu().numpy()
+        watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=self.sr)
+        return torch.from_numpy(watermarked_wav).unsqueeze(0)